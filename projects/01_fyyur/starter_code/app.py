@@ -12,7 +12,8 @@ from flask import (
   Response,
   flash,
   redirect,
-  url_for
+  url_for,
+  stream_with_context
 )
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
@@ -22,7 +23,10 @@ from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
 import sys
+from itertools import groupby
+from datetime import timedelta
 from models import app, db, Venue, Artist, Show
+from search import search
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -47,6 +51,85 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def detail_shows(show_column, entity_id, other, prefix):
+  # past and upcoming shows of one venue or artist in a single query: the
+  # rows are partitioned on start_time in sql, counted per partition with a
+  # window and cut down to the first DETAIL_SHOWS_LIMIT of each side
+  # (soonest upcoming, most recent past)
+  limit = max(app.config.get('DETAIL_SHOWS_LIMIT', 10), 1)
+  upcoming = Show.start_time > datetime.now()
+  partition = db.case([(upcoming, 1)], else_=0)
+  rank = db.func.row_number().over(
+    partition_by=partition,
+    order_by=(db.case([(upcoming, Show.start_time)]), db.case([(~upcoming, Show.start_time)]).desc()))
+  shows = db.session.query(
+      other.id.label('id'),
+      other.name.label('name'),
+      other.image_link.label('image_link'),
+      Show.start_time,
+      partition.label('upcoming'),
+      rank.label('rank'),
+      db.func.count().over(partition_by=partition).label('total')) \
+    .select_from(Show) \
+    .join(other, other.id == getattr(Show, prefix + '_id')) \
+    .filter(show_column == entity_id) \
+    .subquery()
+  query = db.session.query(shows) \
+    .filter(shows.c.rank <= limit) \
+    .order_by(shows.c.upcoming, shows.c.rank)
+
+  data = {'past_shows': [], 'upcoming_shows': [], 'past_shows_count': 0, 'upcoming_shows_count': 0}
+  for row in query:
+    kind = 'upcoming' if row.upcoming else 'past'
+    data[kind + '_shows'].append({
+      prefix + '_id': row.id,
+      prefix + '_name': row.name,
+      prefix + '_image_link': row.image_link,
+      'start_time': str(row.start_time)
+    })
+    data[kind + '_shows_count'] = row.total
+  return data
+
+class ShowPage(object):
+  # lazily iterated page of /shows rows; the query fetches one row more
+  # than the page holds so that next_url is known once iteration ends
+  # without counting the remaining shows
+
+  def __init__(self, query, per_page, args):
+    self.query = query
+    self.per_page = per_page
+    self.args = dict((k, v) for k, v in args.items() if v)
+    self.next_url = None
+
+  def __iter__(self):
+    last = None
+    for n, row in enumerate(self.query.yield_per(self.per_page)):
+      if n == self.per_page:
+        self.next_url = url_for('shows', after=last.start_time.isoformat(), after_id=last.id, **self.args)
+        break
+      last = row
+      yield {
+        'venue_id': row.venue_id,
+        'venue_name': row.venue_name,
+        'artist_id': row.artist_id,
+        'artist_name': row.artist_name,
+        'artist_image_link': row.artist_image_link,
+        'start_time': str(row.start_time)
+      }
+
+def stream_template(template_name, **context):
+  # render a template chunk by chunk so the first bytes go out before the
+  # context iterables are exhausted
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(5)
+  return stream
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -62,60 +145,37 @@ def index():
 @app.route('/venues')
 def venues():
 
+  # one ordered query for every venue plus its upcoming show count,
+  # grouped into areas in python instead of one query per city
+  num_upcoming_shows = db.func.count(Show.id).filter(Show.start_time > datetime.now()).label('num_upcoming_shows')
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, num_upcoming_shows) \
+    .outerjoin(Show, Show.venue_id == Venue.id) \
+    .group_by(Venue.id) \
+    .order_by(Venue.state, Venue.city, Venue.name)
+
   data = []
-  cities = db.session.query(Venue).distinct(Venue.city).all()
-  for result in cities:
-    #print(result.city)
-    venues = Venue.query.filter_by(city=result.city).all()
-    data.append({'city': result.city, 'state': result.state, 'venues': list(venues)})
+  for (city, state), rows in groupby(query, key=lambda row: (row.city, row.state)):
+    venues = [{'id': row.id, 'name': row.name, 'num_upcoming_shows': row.num_upcoming_shows} for row in rows]
+    data.append({'city': city, 'state': state, 'venues': venues})
 
-  return render_template('pages/venues.html', areas=data);
+  return render_template('pages/venues.html', areas=data)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
 
-  response = {}
-  search_term = (request.form['search_term'])
-  query_result = Venue.query.filter(Venue.name.ilike('%'+search_term+'%'))
-  response['count'] = len(list(query_result))
-  response['data'] = query_result
+  search_term = request.form.get('search_term', '')
+  limit = request.form.get('limit', app.config.get('SEARCH_RESULTS_LIMIT', 50), type=int)
+  response = search(Venue, search_term, limit)
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
 
-  result_query_venue = Venue.query.filter_by(id=venue_id).all()[0]
-  data = result_query_venue.__dict__
-  q = db.session.query(Artist, Show).join(Artist.show).filter_by(venue_id=venue_id)
-  qresult = q.all()
-  total_past_shows = 0
-  total_upc_shows = 0
-  past_shows = []
-  upcoming_shows = []
-  for tup in qresult:
-    if tup[1].start_time <= datetime.now():
-      new_past_show = {}
-      new_past_show["artist_id"] = tup[0].id
-      new_past_show["artist_name"] = tup[0].name
-      new_past_show["artist_image_link"] = tup[0].image_link
-      new_past_show["start_time"] = str(tup[1].start_time)
-      past_shows.append(new_past_show)
-      total_past_shows += 1
-    else:
-      new_upc_show = {}
-      new_upc_show["artist_id"] = tup[0].id
-      new_upc_show["artist_name"] = tup[0].name
-      new_upc_show["artist_image_link"] = tup[0].image_link
-      new_upc_show["start_time"] = str(tup[1].start_time)
-      upcoming_shows.append(new_upc_show)
-      total_upc_shows += 1
-
-  data['upcoming_shows'] = upcoming_shows
-  data['past_shows'] = past_shows
-  data['past_shows_count'] = total_past_shows
-  data['upcoming_shows_count'] = total_upc_shows
+  venue = Venue.query.get_or_404(venue_id)
+  data = dict(venue.__dict__)
+  data.update(detail_shows(Show.venue_id, venue_id, Artist, 'artist'))
 
   return render_template('pages/show_venue.html', venue=data)
 
@@ -192,47 +252,18 @@ def artists():
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
 
-  response = {}
-  search_term = (request.form['search_term'])
-  query_result = Artist.query.filter(Artist.name.ilike('%'+search_term+'%'))
-  response['count'] = len(list(query_result))
-  response['data'] = query_result
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.form.get('search_term', '')
+  limit = request.form.get('limit', app.config.get('SEARCH_RESULTS_LIMIT', 50), type=int)
+  response = search(Artist, search_term, limit)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
 
-  result_query_artist = Artist.query.filter_by(id=artist_id).all()[0]
-  data = result_query_artist.__dict__
-  q = db.session.query(Venue, Show).join(Venue.show).filter_by(artist_id=artist_id)
-  qresult = q.all()
-  total_past_shows = 0
-  total_upc_shows = 0
-  past_shows = []
-  upcoming_shows = []
-  for tup in qresult:
-    if tup[1].start_time <= datetime.now():
-      new_past_show = {}
-      new_past_show["venue_id"] = tup[0].id
-      new_past_show["venue_name"] = tup[0].name
-      new_past_show["venue_image_link"] = tup[0].image_link
-      new_past_show["start_time"] = str(tup[1].start_time)
-      past_shows.append(new_past_show)
-      total_past_shows += 1
-    else:
-      new_upc_show = {}
-      new_upc_show["venue_id"] = tup[0].id
-      new_upc_show["venue_name"] = tup[0].name
-      new_upc_show["venue_image_link"] = tup[0].image_link
-      new_upc_show["start_time"] = str(tup[1].start_time)
-      upcoming_shows.append(new_upc_show)
-      total_upc_shows += 1
-
-  data['upcoming_shows'] = upcoming_shows
-  data['past_shows'] = past_shows
-  data['past_shows_count'] = total_past_shows
-  data['upcoming_shows_count'] = total_upc_shows
+  artist = Artist.query.get_or_404(artist_id)
+  data = dict(artist.__dict__)
+  data.update(detail_shows(Show.artist_id, artist_id, Venue, 'venue'))
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -348,26 +379,41 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-
-  data = []
-
-  all_shows_join_query = db.session.query(Venue, Artist, Show).join(Venue).join(Artist)
-  join_result = all_shows_join_query.all()
-
-
-  for result in join_result:
-    a_show = {}
-
-    a_show["venue_id"] = result[0].id
-    a_show["venue_name"] = result[0].name
-    a_show["artist_id"] = result[1].id
-    a_show["artist_name"] = result[1].name
-    a_show["artist_image_link"] = result[1].image_link
-    a_show["start_time"] = str(result[2].start_time)
-
-    data.append(a_show)
-
-  return render_template('pages/shows.html', shows=data)
+  # one page of shows ordered by start time, optionally limited to a date
+  # range; pages are walked with the (start_time, id) of the last show
+  start = request.args.get('from', type=dateutil.parser.parse)
+  end = request.args.get('to', type=dateutil.parser.parse)
+  if end is not None and ':' not in request.args['to']:
+    # a plain date from the "To" picker includes that whole day
+    end += timedelta(days=1)
+  after = request.args.get('after', type=dateutil.parser.parse)
+  after_id = request.args.get('after_id', 0, type=int)
+  per_page = min(max(request.args.get('per_page', app.config.get('SHOWS_PER_PAGE', 50), type=int), 1),
+                 app.config.get('SHOWS_MAX_PER_PAGE', 500))
+
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Venue.id.label('venue_id'),
+      Venue.name.label('venue_name'),
+      Artist.id.label('artist_id'),
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id)
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  if after is not None:
+    query = query.filter(db.tuple_(Show.start_time, Show.id) > db.tuple_(after, after_id))
+  query = query.order_by(Show.start_time, Show.id).limit(per_page + 1)
+
+  page = ShowPage(query, per_page, {'from': request.args.get('from'), 'to': request.args.get('to'), 'per_page': per_page, 'stream': request.args.get('stream')})
+
+  if app.config.get('STREAM_SHOWS') or request.args.get('stream', type=int):
+    return Response(stream_with_context(stream_template('pages/shows.html', shows=page)))
+  return render_template('pages/shows.html', shows=page)
 
 @app.route('/shows/create')
 def create_shows():
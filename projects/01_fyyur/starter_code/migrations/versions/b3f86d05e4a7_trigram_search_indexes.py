@@ -0,0 +1,34 @@
+"""Trigram and genre GIN indexes for venue and artist search.
+
+Revision ID: b3f86d05e4a7
+Revises: 9e4b7a1c2d60
+Create Date: 2026-10-18 13:05:27.940116
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f86d05e4a7'
+down_revision = '9e4b7a1c2d60'
+branch_labels = None
+depends_on = None
+
+trgm_ops = {'name': 'gin_trgm_ops', 'city': 'gin_trgm_ops', 'state': 'gin_trgm_ops'}
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_venue_search_trgm', 'Venue', ['name', 'city', 'state'], unique=False,
+                    postgresql_using='gin', postgresql_ops=trgm_ops)
+    op.create_index('ix_venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artist_search_trgm', 'Artist', ['name', 'city', 'state'], unique=False,
+                    postgresql_using='gin', postgresql_ops=trgm_ops)
+    op.create_index('ix_artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artist_genres', table_name='Artist')
+    op.drop_index('ix_artist_search_trgm', table_name='Artist')
+    op.drop_index('ix_venue_genres', table_name='Venue')
+    op.drop_index('ix_venue_search_trgm', table_name='Venue')
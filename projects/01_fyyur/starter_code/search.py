@@ -0,0 +1,40 @@
+from sqlalchemy.dialects import postgresql
+from models import db
+from forms import genres_choices
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+genres_by_name = dict((value.lower(), value) for value, label in genres_choices)
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search(model, term, limit=50):
+  # venue/artist search in a single query: name substring (served by the
+  # trigram index), city, state or "city, state", and an exact genre name.
+  # Names starting with the term rank first; the total number of matches
+  # comes from a window over the same query, so the matches are neither
+  # counted separately nor fetched twice.
+  term = term.strip()
+  criteria = [model.name.ilike('%' + escape_like(term) + '%', escape='\\')]
+  if ',' in term:
+    city, state = [part.strip() for part in term.rsplit(',', 1)]
+    criteria.append(db.and_(model.city.ilike(escape_like(city), escape='\\'),
+                            model.state.ilike(escape_like(state), escape='\\')))
+  else:
+    criteria.append(model.city.ilike(escape_like(term), escape='\\'))
+    criteria.append(model.state.ilike(escape_like(term), escape='\\'))
+  genre = genres_by_name.get(term.lower())
+  if genre is not None:
+    criteria.append(model.genres.op('@>')(db.cast(postgresql.array([genre]), db.ARRAY(db.String))))
+
+  prefix = db.case([(model.name.ilike(escape_like(term) + '%', escape='\\'), 0)], else_=1)
+  query = db.session.query(model.id, model.name, db.func.count().over().label('total')) \
+    .filter(db.or_(*criteria)) \
+    .order_by(prefix, model.name, model.id) \
+    .limit(max(limit, 1))
+
+  data = query.all()
+  return {'count': data[0].total if data else 0, 'data': data}
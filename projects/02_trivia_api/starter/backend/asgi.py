@@ -0,0 +1,13 @@
+"""ASGI entry point for the trivia API.
+
+    uvicorn asgi:app --workers 4
+
+The routes from create_app run unchanged; asgiref hands each request to a
+thread pool (sized by the ASGI_THREADS environment variable) so one worker
+process serves many concurrent clients while others wait on Postgres.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from flaskr import create_app
+
+app = WsgiToAsgi(create_app())
@@ -1,29 +1,197 @@
 import os
-from flask import Flask, request, abort, jsonify, redirect
+import base64
+import click
+from functools import wraps
+from flask import Flask, Response, g, request, abort, jsonify, redirect, make_response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy import func
 
-from models import setup_db, Question, Category
+from models import setup_db, init_db, database_path, Question, ContentVersion, QuestionCount, is_integer
+from .cache import category_cache, response_cache, category_tag, LRUResponseCache, RedisResponseCache
+from .instrumentation import init_instrumentation
+from .bulk import import_questions, export_questions, gzip_stream, guess_format, IMPORT_FORMATS
+from .search import search_questions, question_index
+from .quiz import pick_random_question, pick_adaptive_question, difficulty_index, build_deck, \
+    InMemoryQuizSessionStore
 
 QUESTIONS_PER_PAGE = 10
 
 
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+def encode_cursor(q_id):
+    return base64.urlsafe_b64encode(str(q_id).encode()).decode().rstrip('=')
 
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
 
-    return current_questions
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        abort(422)
+
+
+def paginate_questions(request, selection, total_questions=None):
+    """Load one page of the `selection` query as formatted question dicts,
+    selecting plain column rows instead of Question objects.
+
+    With `?page=N` the page is fetched with LIMIT/OFFSET and the whole selection
+    is counted, unless `total_questions` is already known.
+    With `?after_id=<cursor>` the page is fetched by keyset (id > cursor, in id
+    order) and no count is run, so every page costs the same; total_questions
+    is then None.
+    Returns (current_questions, total_questions, next_cursor).
+    """
+    after_id = request.args.get('after_id', None)
+
+    if after_id is not None:
+        page_rows = selection.with_entities(*Question.format_columns()) \
+            .filter(Question.id > decode_cursor(after_id)) \
+            .order_by(None).order_by(Question.id).limit(QUESTIONS_PER_PAGE + 1).all()
+        has_more = len(page_rows) > QUESTIONS_PER_PAGE
+        page_rows = page_rows[:QUESTIONS_PER_PAGE]
+        total_questions = None
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], 0, None
+
+        if total_questions is None:
+            total_questions = selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        page_rows = selection.with_entities(*Question.format_columns()) \
+            .limit(QUESTIONS_PER_PAGE).offset(start).all()
+        has_more = start + len(page_rows) < total_questions
+
+    current_questions = [Question.format_row(row) for row in page_rows]
+    next_cursor = encode_cursor(page_rows[-1].id) if page_rows and has_more else None
+
+    return current_questions, total_questions, next_cursor
+
+
+def batch_criteria(body):
+    """ids / category / difficulty that select the questions of a batch request."""
+    if not isinstance(body, dict):
+        abort(422)
+    ids = body.get('ids')
+    filters = body.get('filter')
+    if filters is None:
+        filters = {}
+
+    if not isinstance(filters, dict):
+        abort(422)
+    if ids is not None and (not isinstance(ids, list) or not all(is_integer(q_id) for q_id in ids)):
+        abort(422)
+    if any(filters.get(key) is not None and not is_integer(filters[key]) for key in ('category', 'difficulty')):
+        abort(422)
+    if ids is None and filters.get('category') is None and filters.get('difficulty') is None:
+        abort(422)
+
+    return {
+        'ids': ids,
+        'category': filters.get('category'),
+        'difficulty': filters.get('difficulty')
+    }
+
+
+def batch_results(requested_ids, done_ids, status):
+    """Per-id outcome of a batch request; requested ids that matched nothing are 'not_found'."""
+    if requested_ids is None:
+        return [{'id': q_id, 'status': status} for q_id in done_ids]
+
+    done_ids = set(done_ids)
+    return [{'id': q_id, 'status': status if q_id in done_ids else 'not_found'} for q_id in requested_ids]
+
+
+def categories_etag():
+    """The counts variant of /categories changes with the questions too."""
+    if request.args.get('counts'):
+        return questions_etag()
+    return category_cache.etag()
+
+
+def questions_etag():
+    """Changes with every question write and every category change.
+
+    Read once per request: conditional and cached both need it, and the
+    second content_versions lookup would double the cost of a cache hit."""
+    if 'questions_etag' not in g:
+        g.questions_etag = '{}-{}'.format(ContentVersion.get(Question.__tablename__), category_cache.etag()[:16])
+    return g.questions_etag
+
+
+def conditional(etag_function):
+    """Answer GET requests whose If-None-Match matches `etag_function()` with a
+    304 before the view runs, and tag successful responses with the ETag."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = etag_function()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def cached(tags_function):
+    """Serve successful responses from response_cache, keyed by the content
+    version (see questions_etag) and the path and query string; entries are
+    tagged with `tags_function(**view_args)` so question writes can invalidate
+    exactly the listings they affect.
+
+    The version is read before the view runs, so a page rendered from rows
+    older than a write, or cached by a worker that never saw the write's
+    invalidation, is stored under a key that is no longer requested."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = '{} {}'.format(questions_etag(), request.full_path)
+            body = response_cache.get(key)
+            if body is not None:
+                return Response(body, mimetype='application/json')
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response_cache.set(key, response.get_data(), tags_function(*args, **kwargs))
+            return response
+        return wrapper
+    return decorator
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path), app.config.get('CREATE_TABLES'))
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or InMemoryQuizSessionStore()
+    category_cache.ttl = app.config.get('CATEGORY_CACHE_TTL', 300)
+    category_cache.invalidate()
+    question_index.clear()
+    difficulty_index.clear()
+
+    if app.config.get('RESPONSE_CACHE_URL'):
+        response_cache.backend = RedisResponseCache(app.config['RESPONSE_CACHE_URL'])
+    elif app.config.get('RESPONSE_CACHE', True):
+        response_cache.backend = LRUResponseCache(app.config.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    else:
+        response_cache.backend = None
+
+    if app.config.get('INSTRUMENTATION'):
+        init_instrumentation(app)
+
+    # g outlives the request when a test or command already holds an app
+    # context, so the version read by the previous request is dropped here
+    @app.before_request
+    def forget_questions_etag():
+        g.pop('questions_etag', None)
 
     '''
   @TODO-DONE: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -38,7 +206,7 @@ def create_app(test_config=None):
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,PATCH,POST,DELETE,OPTIONS')
         return response
 
     '''
@@ -48,13 +216,20 @@ def create_app(test_config=None):
   '''
 
     @app.route('/categories')
+    @conditional(categories_etag)
     def retrieve_categories():
-        categories = Category.query.order_by(Category.id).all()
+        catgs_dict = category_cache.get()
 
-        if len(categories) == 0:
+        if len(catgs_dict) == 0:
             abort(404)
 
-        catgs_dict = {cat.id: cat.type for cat in categories}
+        if request.args.get('counts'):
+            totals = QuestionCount.totals()
+            return jsonify({
+                'categories': catgs_dict,
+                'question_counts': {cat_id: totals.get(cat_id, {'total': 0, 'by_difficulty': {}})
+                                    for cat_id in catgs_dict}
+            })
 
         return jsonify({
             'categories': catgs_dict
@@ -74,21 +249,23 @@ def create_app(test_config=None):
   '''
 
     @app.route('/questions')
+    @conditional(questions_etag)
+    @cached(lambda: ['questions'])
     def retrieve_questions():
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        selection = Question.query.order_by(Question.id)
+        current_questions, total_questions, next_cursor = paginate_questions(request, selection)
 
-        categories = Category.query.order_by(Category.id).all()
-        catgs_dict = {cat.id: cat.type for cat in categories}
+        catgs_dict = category_cache.get()
 
         if len(current_questions) == 0:
             abort(404)
 
         return jsonify({
             'questions': current_questions,
-            'total_questions': len(selection),
+            'total_questions': total_questions,
             'current_category': None,
-            'categories': catgs_dict
+            'categories': catgs_dict,
+            'next_cursor': next_cursor
         })
 
     '''
@@ -116,6 +293,41 @@ def create_app(test_config=None):
         except:
             abort(422)
 
+    @app.route('/questions', methods=['DELETE'])
+    def batch_delete_questions():
+        criteria = batch_criteria(request.get_json() or {})
+
+        deleted_ids = Question.delete_many(**criteria)
+
+        return jsonify({
+            'success': True,
+            'deleted': len(deleted_ids),
+            'results': batch_results(criteria['ids'], deleted_ids, 'deleted')
+        })
+
+    @app.route('/questions', methods=['PATCH'])
+    def batch_update_questions():
+        body = request.get_json() or {}
+        criteria = batch_criteria(body)
+        changes = body.get('changes')
+
+        if not changes or not isinstance(changes, dict) or set(changes) - {'category', 'difficulty'}:
+            abort(422)
+        if not all(is_integer(value) for value in changes.values()):
+            abort(422)
+        if 'category' in changes and changes['category'] not in category_cache.get():
+            abort(422)
+        if 'difficulty' in changes and changes['difficulty'] not in range(1, 6):
+            abort(422)
+
+        updated_ids = Question.update_many(changes, **criteria)
+
+        return jsonify({
+            'success': True,
+            'updated': len(updated_ids),
+            'results': batch_results(criteria['ids'], updated_ids, 'updated')
+        })
+
     '''
   @TODO-DONE: 
   Create an endpoint to POST a new question, 
@@ -150,18 +362,27 @@ def create_app(test_config=None):
 
         try:
             if search:
-                selection = Question.query.order_by(Question.id).filter(Question.question.ilike('%{}%'.format(search)))
-                select_result = paginate_questions(request, selection)
+                # ranked results page by ?page= only: an id cursor would not
+                # follow the ranking
+                if request.args.get('after_id') is not None:
+                    abort(422)
+                page = request.args.get('page', 1, type=int)
+                if page < 1:
+                    abort(404)
+                count_limit = app.config.get('SEARCH_COUNT_LIMIT', 10000)
+                rows, total_questions = search_questions(search, (page - 1) * QUESTIONS_PER_PAGE,
+                                                         QUESTIONS_PER_PAGE, count_limit)
+                select_result = [Question.format_row(row) for row in rows]
 
-                categories = Category.query.order_by(Category.id).all()
-                catgs_dict = {cat.id: cat.type for cat in categories}
+                catgs_dict = category_cache.get()
 
                 if len(select_result) == 0:
                     abort(404)
 
                 return jsonify({
                     'questions': select_result,
-                    'total_questions': len(select_result),
+                    'total_questions': total_questions,
+                    'total_is_estimate': total_questions > count_limit,
                     'current_category': None,
                     'categories': catgs_dict
                 })
@@ -180,6 +401,77 @@ def create_app(test_config=None):
         except:
             abort(422)
 
+    @app.route('/questions/import', methods=['POST'])
+    def bulk_import_questions():
+        upload = request.files.get('file')
+        if upload is not None:
+            stream = upload.stream
+            fmt = request.args.get('format') or guess_format(upload.filename)
+        else:
+            stream = request.stream
+            fmt = request.args.get('format') or guess_format(request.mimetype)
+
+        if fmt not in IMPORT_FORMATS:
+            abort(422)
+
+        # bytes lines: read_rows decodes each one and reports the ones that are
+        # not UTF-8 as row errors
+        result = import_questions(stream, fmt)
+
+        return jsonify(dict(result, success=True))
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables and indexes that do not exist yet."""
+        init_db()
+        click.echo('database initialized')
+
+    @app.cli.command('rebuild-question-counts')
+    def rebuild_question_counts_command():
+        """Recount the questions per category and difficulty from scratch."""
+        QuestionCount.rebuild()
+        click.echo('question counts rebuilt')
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+                  help='Defaults to the file extension.')
+    def import_questions_command(source, fmt):
+        """Bulk import questions from a JSON Lines or CSV file ('-' for stdin)."""
+        fmt = fmt or guess_format(source.name)
+        if fmt is None:
+            raise click.UsageError('cannot tell the format of {}, pass --format'.format(source.name))
+
+        result = import_questions(source, fmt)
+
+        for error in result['errors']:
+            click.echo('line {line}: {error}'.format(**error), err=True)
+        click.echo('imported {} questions, {} rows rejected'.format(result['imported'], result['error_count']))
+
+    @app.route('/questions/export')
+    def bulk_export_questions():
+        lines = export_questions(request.args.getlist('category', type=int))
+        # the body depends on Accept-Encoding, so caches must key on it too
+        headers = {'Content-Disposition': 'attachment; filename=questions.jsonl', 'Vary': 'Accept-Encoding'}
+
+        if 'gzip' in request.accept_encodings:
+            lines = gzip_stream(lines)
+            headers['Content-Encoding'] = 'gzip'
+
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson', headers=headers)
+
+    @app.cli.command('export-questions')
+    @click.argument('output', type=click.File('wb'), default='-')
+    @click.option('--category', 'categories', type=int, multiple=True,
+                  help='Only export this category; can be repeated.')
+    @click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+    def export_questions_command(output, categories, compress):
+        """Export the question bank as NDJSON to OUTPUT (stdout by default)."""
+        lines = export_questions(categories)
+        chunks = gzip_stream(lines) if compress else (line.encode('utf-8') for line in lines)
+        for chunk in chunks:
+            output.write(chunk)
+
     '''
   @TODO-DONE: 
   Create a POST endpoint to get questions based on a search term. 
@@ -201,22 +493,25 @@ def create_app(test_config=None):
   '''
 
     @app.route('/categories/<int:cat_id>/questions')
+    @conditional(questions_etag)
+    @cached(lambda cat_id: [category_tag(cat_id)])
     def retrieve_questions_by_category(cat_id):
 
-        selection = Question.query.order_by(Question.id).filter(Question.category == cat_id).all()
-        current_questions = paginate_questions(request, selection)
+        selection = Question.query.order_by(Question.id).filter(Question.category == cat_id)
+        current_questions, total_questions, next_cursor = paginate_questions(request, selection,
+                                                                             total_questions=QuestionCount.total(cat_id))
 
-        categories = Category.query.order_by(Category.id).all()
-        catgs_dict = {cat.id: cat.type for cat in categories}
+        catgs_dict = category_cache.get()
 
         if len(current_questions) == 0:
             abort(404)
 
         return jsonify({
             'questions': current_questions,
-            'total_questions': len(selection),
+            'total_questions': total_questions,
             'current_category': None,
-            'categories': catgs_dict
+            'categories': catgs_dict,
+            'next_cursor': next_cursor
         })
 
     '''
@@ -243,20 +538,69 @@ def create_app(test_config=None):
 
         cat_id = category_dict.get('id')
 
-        if cat_id == 0:
-            selection = Question.query.all()
-        else:
-            selection = Question.query.filter(Question.category == cat_id).all()
-        current_questions = [question.format() for question in selection]
+        if body.get('mode') == 'adaptive':
+            difficulty = body.get('difficulty', 3)
+            recent_answers = body.get('recent_answers')
+            if not is_integer(difficulty):
+                abort(422)
+            if recent_answers is not None and not isinstance(recent_answers, list):
+                abort(422)
+
+            question, difficulty = pick_adaptive_question(cat_id, prev_qs_list, difficulty, recent_answers)
+
+            return jsonify({
+                'question': question.format() if question else None,
+                'difficulty': difficulty
+            })
+
+        question = pick_random_question(cat_id, prev_qs_list)
+
+        return jsonify({
+            'question': question.format() if question else None
+        })
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json()
+
+        category_dict = body.get('quiz_category', None)
+
+        if not category_dict:
+            abort(422)
+
+        deck = build_deck(category_dict.get('id'))
+        session_id = quiz_sessions.create(deck)
+
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'total_questions': len(deck)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_question_for_quiz_session(session_id):
+        try:
+            q_id = quiz_sessions.pop(session_id)
+            # questions deleted since the deck was dealt are skipped
+            question = None
+            while q_id is not None:
+                question = Question.query.get(q_id)
+                if question is not None:
+                    break
+                q_id = quiz_sessions.pop(session_id)
+        except KeyError:
+            abort(404)
+
+        return jsonify({
+            'question': question.format() if question else None
+        })
 
-        question = None
-        random.shuffle(current_questions)
-        for q in current_questions:
-            if q['id'] not in prev_qs_list:
-                question = q
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def delete_quiz_session(session_id):
+        quiz_sessions.delete(session_id)
 
         return jsonify({
-            'question': question
+            'success': True
         })
 
     '''
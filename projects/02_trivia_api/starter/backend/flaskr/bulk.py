@@ -0,0 +1,184 @@
+import csv
+import json
+import zlib
+
+from collections import Counter
+
+from models import db, Question, Category, ContentVersion, QuestionCount, questions_changed, is_integer
+from .search import question_index
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ('jsonl', 'csv')
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def guess_format(name_or_mimetype):
+    """'jsonl' or 'csv' from a file name or mimetype, None if neither."""
+    name = (name_or_mimetype or '').lower()
+    if name.endswith(('.csv', '/csv')):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '/x-ndjson', '/jsonl', '/x-jsonlines')):
+        return 'jsonl'
+    return None
+
+
+def decode_lines(lines):
+    """Yield (line_number, text) for every line of a text or bytes stream;
+    text is None for a bytes line that is not valid UTF-8."""
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                line = None
+        yield line_number, line
+
+
+def read_rows(lines, fmt):
+    """Yield (line_number, row) for every record of a JSON Lines or CSV text
+    or bytes stream; row is a dict, or an error message if the line could not
+    be decoded or parsed."""
+    numbered = decode_lines(lines)
+
+    if fmt == 'csv':
+        position = {'line': 0}
+        undecodable = []
+
+        def text_lines():
+            for line_number, line in numbered:
+                position['line'] = line_number
+                if line is None:
+                    undecodable.append(line_number)
+                    continue
+                yield line
+
+        for row in csv.DictReader(text_lines()):
+            for line_number in undecodable:
+                yield line_number, 'not valid UTF-8'
+            del undecodable[:]
+            yield position['line'], row
+        for line_number in undecodable:
+            yield line_number, 'not valid UTF-8'
+        return
+
+    for line_number, line in numbered:
+        if line is None:
+            yield line_number, 'not valid UTF-8'
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, 'invalid JSON: {}'.format(e)
+            continue
+        yield line_number, row if isinstance(row, dict) else 'expected a JSON object'
+
+
+def parse_integer(value, fmt):
+    """JSON values must already be integers; CSV cells must be digit strings."""
+    if fmt == 'csv' and isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if fmt != 'csv' and is_integer(value):
+        return value
+    raise ValueError('category and difficulty must be integers')
+
+
+def validate_row(row, category_ids, fmt):
+    """Column values for a new question, or raise ValueError naming the problem."""
+    missing = [field for field in QUESTION_FIELDS if row.get(field) in (None, '')]
+    if missing:
+        raise ValueError('missing {}'.format(', '.join(missing)))
+
+    category = parse_integer(row['category'], fmt)
+    difficulty = parse_integer(row['difficulty'], fmt)
+
+    if category not in category_ids:
+        raise ValueError('unknown category {}'.format(category))
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+
+    return {
+        'question': str(row['question']),
+        'answer': str(row['answer']),
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+def import_questions(lines, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and insert the questions of a JSON Lines or CSV text or bytes stream.
+
+    Valid rows are inserted with one executemany INSERT and one commit per
+    `batch_size` rows; invalid rows are skipped and reported by line number.
+    """
+    category_ids = {cat_id for cat_id, in db.session.query(Category.id)}
+    insert = Question.__table__.insert()
+    imported = 0
+    error_count = 0
+    errors = []
+    batch = []
+
+    def flush():
+        db.session.execute(insert, batch)
+        QuestionCount.adjust(Counter((row['category'], row['difficulty']) for row in batch))
+        ContentVersion.bump(Question.__tablename__)
+        db.session.commit()
+        questions_changed(row['category'] for row in batch)
+        del batch[:]
+
+    for line_number, row in read_rows(lines, fmt):
+        try:
+            if isinstance(row, str):
+                raise ValueError(row)
+            batch.append(validate_row(row, category_ids, fmt))
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line_number, 'error': str(e)})
+            continue
+
+        imported += 1
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    if imported:
+        # Core inserts skip the ORM events that maintain the search index
+        question_index.clear()
+
+    return {
+        'imported': imported,
+        'error_count': error_count,
+        'errors': errors
+    }
+
+
+def export_questions(categories=None):
+    """Yield every question (optionally only those of `categories`) as one
+    NDJSON line each, in id order.
+
+    Rows are read through a server-side cursor EXPORT_BATCH_SIZE at a time,
+    so memory use does not grow with the size of the question bank.
+    """
+    selection = Question.query.order_by(Question.id)
+    if categories:
+        selection = selection.filter(Question.category.in_(categories))
+
+    rows = selection.with_entities(*Question.format_columns()).execution_options(stream_results=True)
+    for row in rows.yield_per(EXPORT_BATCH_SIZE):
+        yield json.dumps(Question.format_row(row)) + '\n'
+
+
+def gzip_stream(chunks):
+    """Gzip-compress a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from models import Category, on_questions_changed
+
+
+class CategoryCache:
+    """Process-wide {id: type} map of the categories.
+
+    The map is loaded once and reused by every handler until `ttl` seconds
+    have passed or `invalidate()` is called. Category inserts, updates and
+    deletes made through the ORM invalidate it automatically.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._categories = None
+        self._etag = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._categories is None or time.monotonic() - self._loaded_at > self.ttl:
+            categories = Category.query.order_by(Category.id).all()
+            self._categories = {cat.id: cat.type for cat in categories}
+            self._etag = hashlib.sha1(json.dumps(sorted(self._categories.items())).encode()).hexdigest()
+            self._loaded_at = time.monotonic()
+
+    def get(self):
+        with self._lock:
+            self._load()
+            return self._categories
+
+    def etag(self):
+        """Hash of the current category map."""
+        with self._lock:
+            self._load()
+            return self._etag
+
+    def invalidate(self):
+        with self._lock:
+            self._categories = None
+
+
+category_cache = CategoryCache()
+
+
+def _invalidate_category_cache(mapper, connection, target):
+    category_cache.invalidate()
+    # every listing embeds the category map
+    response_cache.clear()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event_name, _invalidate_category_cache)
+
+
+class LRUResponseCache:
+    """In-process cache of response bodies with LRU eviction.
+
+    Every entry is stored with a set of tags, and `invalidate(tags)` drops the
+    entries carrying any of them. The total size of the cached bodies is kept
+    under `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, body, tags):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (body, frozenset(tags))
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for key in [key for key, (_, entry_tags) in self._entries.items() if entry_tags & tags]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+class RedisResponseCache:
+    """Response cache kept in a Redis-compatible server, shared by all workers.
+
+    Tags are Redis sets of the keys carrying them. Needs the optional `redis`
+    package.
+    """
+
+    def __init__(self, url, prefix='trivia:response:', ttl=3600):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_URL needs the redis package (pip install redis)')
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        return self._redis.get(self.prefix + key)
+
+    def set(self, key, body, tags):
+        pipeline = self._redis.pipeline()
+        pipeline.set(self.prefix + key, body, ex=self.ttl)
+        for tag in tags:
+            pipeline.sadd(self.prefix + 'tag:' + tag, self.prefix + key)
+            pipeline.expire(self.prefix + 'tag:' + tag, self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, tags):
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys = self._redis.smembers(tag_key)
+            self._redis.delete(tag_key, *keys)
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class ResponseCache:
+    """Front for the response cache backend that create_app configures;
+    does nothing while no backend is set."""
+
+    def __init__(self):
+        self.backend = None
+
+    def get(self, key):
+        return self.backend.get(key) if self.backend is not None else None
+
+    def set(self, key, body, tags):
+        if self.backend is not None:
+            self.backend.set(key, body, tags)
+
+    def invalidate(self, tags):
+        if self.backend is not None:
+            self.backend.invalidate(set(tags))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def category_tag(category):
+    return 'category:{}'.format(category)
+
+
+@on_questions_changed
+def _invalidate_question_listings(categories):
+    # any write changes total_questions on every /questions page, but only
+    # the listings of the categories that were touched
+    response_cache.invalidate(['questions'] + [category_tag(category) for category in categories])
@@ -0,0 +1,141 @@
+import bisect
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event
+
+from models import db
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info['query_started_at'].pop()
+    if has_app_context() and 'query_count' in g:
+        g.query_count += 1
+        g.db_time += time.perf_counter() - started_at
+
+
+def instrument_engine(engine):
+    """Time the queries of `engine` only, so apps without instrumentation do
+    not pay for the cursor events."""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class EndpointMetrics:
+    """Request count, latency histogram and SQL totals per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, duration_ms, query_count, db_ms):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'total_ms': 0.0,
+                'queries': 0,
+                'db_ms': 0.0,
+                'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            })
+            stats['requests'] += 1
+            stats['total_ms'] += duration_ms
+            stats['queries'] += query_count
+            stats['db_ms'] += db_ms
+            stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+
+    def snapshot(self):
+        labels = ['le_{}'.format(bound) for bound in LATENCY_BUCKETS_MS] + ['le_inf']
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': stats['requests'],
+                    'mean_ms': round(stats['total_ms'] / stats['requests'], 3),
+                    'queries_per_request': round(stats['queries'] / stats['requests'], 2),
+                    'db_ms_per_request': round(stats['db_ms'] / stats['requests'], 3),
+                    'latency_ms': dict(zip(labels, stats['buckets']))
+                }
+                for endpoint, stats in self._endpoints.items()
+            }
+
+
+def init_instrumentation(app):
+    """Count SQL queries and DB time per request, add a Server-Timing header,
+    profile a sample of requests (logging the profile of slow ones) and serve
+    per-endpoint histograms at /metrics.
+
+    Settings: SLOW_REQUEST_MS (default 500) and PROFILE_SAMPLE_RATE, the
+    fraction of requests run under cProfile (default 0.01).
+    """
+    metrics = EndpointMetrics()
+    slow_request_ms = app.config.get('SLOW_REQUEST_MS', 500)
+    profile_sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.01)
+
+    # the engine is only final once the database URI is, which setup_db may
+    # still change after create_app
+    @app.before_first_request
+    def instrument_app_engine():
+        instrument_engine(db.engine)
+
+    @app.before_request
+    def start_request_timer():
+        g.query_count = 0
+        g.db_time = 0.0
+        g.profiler = None
+        if random.random() < profile_sample_rate:
+            g.profiler = cProfile.Profile()
+            try:
+                g.profiler.enable()
+            except ValueError:
+                # another profiler is already active
+                g.profiler = None
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        if 'request_started_at' not in g:
+            return response
+
+        duration_ms = (time.perf_counter() - g.request_started_at) * 1000
+        response.headers.add('Server-Timing', 'db;dur={:.3f};desc="{} queries", app;dur={:.3f}'.format(
+            g.db_time * 1000, g.query_count, duration_ms))
+        return response
+
+    # teardown also runs when the view raised and after_request was skipped,
+    # so a sampled profiler is always switched off again
+    @app.teardown_request
+    def record_request_metrics(exc):
+        if 'request_started_at' not in g:
+            return
+
+        duration_ms = (time.perf_counter() - g.request_started_at) * 1000
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if duration_ms >= slow_request_ms:
+                report = io.StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(25)
+                app.logger.warning('slow request %s %s took %.1f ms (%d queries)\n%s',
+                                   request.method, request.full_path, duration_ms, g.query_count,
+                                   report.getvalue())
+
+        metrics.record(request.endpoint or 'unmatched', duration_ms, g.query_count, g.db_time * 1000)
+
+    @app.route('/metrics')
+    def retrieve_metrics():
+        return jsonify({
+            'endpoints': metrics.snapshot()
+        })
+
+    return metrics
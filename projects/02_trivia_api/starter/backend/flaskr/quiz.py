@@ -0,0 +1,220 @@
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from models import db, Question, on_questions_changed
+
+DIFFICULTIES = range(1, 6)
+ADAPTIVE_WINDOW = 3
+REJECTION_ATTEMPTS = 8
+
+
+def category_questions(cat_id):
+    if cat_id == 0:
+        return Question.query
+    return Question.query.filter(Question.category == cat_id)
+
+
+def pick_random_question(cat_id, previous_questions):
+    """Pick a random question of the category that is not in `previous_questions`.
+
+    The id is drawn from the category's cached id list (see DifficultyIndex),
+    so every unseen question is equally likely and a turn costs one primary
+    key lookup however many questions the category has.
+    """
+    return fetch_picked_question(cat_id, difficulty_index.pick_any, previous_questions)
+
+
+def build_deck(cat_id):
+    """Shuffled list of the ids of every question in the category."""
+    deck = [q_id for q_id, in category_questions(cat_id).with_entities(Question.id)]
+    random.shuffle(deck)
+    return deck
+
+
+class InMemoryQuizSessionStore:
+    """Keeps each quiz session's remaining deck of question ids in process.
+
+    Any object with the same create/pop/delete methods can be passed to
+    create_app as QUIZ_SESSION_STORE to keep the decks somewhere shared.
+    Sessions expire after `ttl` seconds of inactivity and the least recently
+    used ones are dropped beyond `max_sessions`.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, deck):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = (deck, time.monotonic())
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def pop(self, session_id):
+        """Next question id of the session, or None once the deck is used up.
+        Raises KeyError for unknown or expired sessions."""
+        now = time.monotonic()
+        with self._lock:
+            deck, last_used = self._sessions[session_id]
+            if now - last_used > self.ttl:
+                del self._sessions[session_id]
+                raise KeyError(session_id)
+            self._sessions[session_id] = (deck, now)
+            self._sessions.move_to_end(session_id)
+            return deck.pop() if deck else None
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+def target_difficulty(current, recent_answers):
+    """Next difficulty band: one up when at least two thirds of the last
+    ADAPTIVE_WINDOW answers were right, one down when at most a third were."""
+    recent = [bool(answer) for answer in (recent_answers or [])[-ADAPTIVE_WINDOW:]]
+    if recent:
+        accuracy = sum(recent) / len(recent)
+        if accuracy >= 2 / 3:
+            current += 1
+        elif accuracy <= 1 / 3:
+            current -= 1
+    return min(max(current, DIFFICULTIES[0]), DIFFICULTIES[-1])
+
+
+def pick_unseen(ids, seen):
+    """Random id of `ids` that is not in `seen`, None when all were seen."""
+    if not ids:
+        return None
+    for _ in range(REJECTION_ATTEMPTS):
+        q_id = random.choice(ids)
+        if q_id not in seen:
+            return q_id
+    # nearly exhausted: fall back to a scan
+    unseen = [q_id for q_id in ids if q_id not in seen]
+    return random.choice(unseen) if unseen else None
+
+
+class DifficultyIndex:
+    """Question ids of each category, also grouped by difficulty, so a random
+    question (of a given difficulty) is picked in O(1) without touching the
+    questions table.
+
+    A category's ids are loaded on first use and dropped whenever its
+    questions change (see models.on_questions_changed). Every drop bumps the
+    category's generation, and a load only stores its rows if the generation
+    it started under is still current, so rows read before a write cannot
+    replace the invalidation that followed it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            # generations are never reset, or a load started before clear()
+            # could find its old generation current again
+            for category in self._generations:
+                self._generations[category] += 1
+
+    def _bump(self, category):
+        self._entries.pop(category, None)
+        self._generations[category] = self._generations.get(category, 0) + 1
+
+    def invalidate(self, categories):
+        with self._lock:
+            for category in categories:
+                self._bump(str(category))
+            # the all-categories entry contains every question
+            self._bump(None)
+
+    def _entry(self, category):
+        """({difficulty: [question ids]}, [question ids]) of a category (None
+        for all of them)."""
+        with self._lock:
+            entry = self._entries.get(category)
+            generation = self._generations.setdefault(category, 0)
+        if entry is not None:
+            return entry
+
+        rows = db.session.query(Question.id, Question.difficulty)
+        if category is not None:
+            rows = rows.filter(Question.category == category)
+        buckets = {}
+        ids = []
+        for q_id, difficulty in rows:
+            buckets.setdefault(difficulty, []).append(q_id)
+            ids.append(q_id)
+        entry = (buckets, ids)
+
+        with self._lock:
+            if self._generations[category] == generation:
+                self._entries[category] = entry
+        return entry
+
+    def buckets(self, category):
+        """{difficulty: [question ids]} of a category (None for all of them)."""
+        return self._entry(category)[0]
+
+    def ids(self, category):
+        """[question ids] of a category (None for all of them)."""
+        return self._entry(category)[1]
+
+    def pick(self, category, difficulty, previous_questions):
+        """Random unseen question id at `difficulty`, else at the closest band
+        that still has one; None when every question was asked."""
+        buckets = self.buckets(category)
+        seen = set(previous_questions or [])
+        bands = sorted(DIFFICULTIES, key=lambda band: (abs(band - difficulty), band))
+
+        for band in bands:
+            q_id = pick_unseen(buckets.get(band), seen)
+            if q_id is not None:
+                return q_id
+
+        return None
+
+    def pick_any(self, category, previous_questions):
+        """Random unseen question id of any difficulty; None when every
+        question was asked."""
+        return pick_unseen(self.ids(category), set(previous_questions or []))
+
+
+difficulty_index = DifficultyIndex()
+on_questions_changed(difficulty_index.invalidate)
+
+
+def fetch_picked_question(cat_id, pick, previous_questions):
+    """The question whose id `pick(category, excluded)` returns, or None.
+
+    The index is per process, so another worker may have deleted the picked
+    question: then the category is reloaded and the pick repeated without it.
+    """
+    category = None if str(cat_id) == '0' else str(cat_id)
+    excluded = list(previous_questions or [])
+    while True:
+        q_id = pick(category, excluded)
+        if q_id is None:
+            return None
+        question = Question.query.get(q_id)
+        if question is not None:
+            return question
+        difficulty_index.invalidate([category])
+        excluded.append(q_id)
+
+
+def pick_adaptive_question(cat_id, previous_questions, difficulty, recent_answers):
+    """(question, difficulty band aimed for) for an adaptive quiz turn."""
+    target = target_difficulty(difficulty, recent_answers)
+    question = fetch_picked_question(cat_id, lambda category, excluded:
+                                     difficulty_index.pick(category, target, excluded), previous_questions)
+    return question, target
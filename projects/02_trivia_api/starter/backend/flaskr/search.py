@@ -0,0 +1,180 @@
+import bisect
+import re
+import threading
+from collections import Counter
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Question
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def question_document():
+    """The text that is searched: question and answer. Must stay in sync with
+    the ix_questions_fts expression index declared in models.py."""
+    return func.to_tsvector('english', func.coalesce(Question.question, '') + ' ' + func.coalesce(Question.answer, ''))
+
+
+class InvertedIndex:
+    """In-process inverted index over question and answer text.
+
+    Used instead of PostgreSQL full-text search when the app runs on another
+    database (e.g. SQLite test databases). It is built on the first search and
+    then kept up to date by the Question insert/update/delete events below.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+            self._postings = {}
+            self._documents = {}
+            self._vocabulary = []
+
+    def _load(self):
+        rows = db.session.query(Question.id, Question.question, Question.answer)
+        for q_id, question, answer in rows:
+            self._add(q_id, question, answer)
+        self._loaded = True
+
+    def _add(self, q_id, question, answer):
+        terms = Counter(tokenize(question) + tokenize(answer))
+        self._documents[q_id] = terms
+        for term, frequency in terms.items():
+            if term not in self._postings:
+                self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            self._postings[term][q_id] = frequency
+
+    def _remove(self, q_id):
+        for term in self._documents.pop(q_id, ()):
+            postings = self._postings[term]
+            postings.pop(q_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+
+    def update(self, q_id, question, answer):
+        with self._lock:
+            if self._loaded:
+                self._remove(q_id)
+                self._add(q_id, question, answer)
+
+    def remove(self, q_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(q_id)
+
+    def _prefix_scores(self, prefix):
+        scores = Counter()
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            scores.update(self._postings[term])
+        return scores
+
+    def search(self, term):
+        """Ids of the questions containing every word of `term` as a word
+        prefix, best matches (most occurrences) first."""
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            scores = None
+            for token in tokens:
+                token_scores = self._prefix_scores(token)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = Counter({q_id: scores[q_id] + token_scores[q_id]
+                                      for q_id in scores if q_id in token_scores})
+
+        return sorted(scores, key=lambda q_id: (-scores[q_id], q_id))
+
+
+question_index = InvertedIndex()
+
+
+def _index_question(mapper, connection, target):
+    question_index.update(target.id, target.question, target.answer)
+
+
+def _unindex_question(mapper, connection, target):
+    question_index.remove(target.id)
+
+
+event.listen(Question, 'after_insert', _index_question)
+event.listen(Question, 'after_update', _index_question)
+event.listen(Question, 'after_delete', _unindex_question)
+
+
+def _reset_index_after_bulk_write(context):
+    # set-based UPDATE/DELETE does not say which rows changed
+    if context.mapper.class_ is Question:
+        question_index.clear()
+
+
+event.listen(Session, 'after_bulk_update', _reset_index_after_bulk_write)
+event.listen(Session, 'after_bulk_delete', _reset_index_after_bulk_write)
+
+
+def count_questions(selection, count_limit):
+    """Number of questions in the `selection` query, from one COUNT query that
+    stops after count_limit + 1 rows. For larger results PostgreSQL's row
+    estimate for the query is returned instead, always more than count_limit
+    so callers can tell estimates from exact counts.
+    """
+    selection = selection.order_by(None)
+    capped = selection.with_entities(Question.id).limit(count_limit + 1).subquery()
+    total = db.session.query(func.count()).select_from(capped).scalar()
+    if total <= count_limit:
+        return total
+
+    statement = selection.with_entities(Question.id).statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(statement), statement.params).scalar()
+    return max(int(plan[0]['Plan']['Plan Rows']), total)
+
+
+def search_questions(term, start, limit, count_limit):
+    """(rows, total) for one page of the questions whose question or answer
+    text contains every word of `term` as a word prefix, best matches first;
+    rows are Question.format_columns() rows.
+
+    On PostgreSQL this is a ranked tsvector match served by the GIN index,
+    counted with count_questions. Elsewhere the in-process inverted index
+    ranks the ids, the page is sliced from them and only its rows are loaded.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        tokens = tokenize(term)
+        if not tokens:
+            return [], 0
+
+        document = question_document()
+        query = func.to_tsquery('english', ' & '.join(token + ':*' for token in tokens))
+        selection = Question.query.filter(document.op('@@')(query))
+        rows = selection.with_entities(*Question.format_columns()) \
+            .order_by(func.ts_rank(document, query).desc(), Question.id) \
+            .limit(limit).offset(start).all()
+        return rows, count_questions(selection, count_limit)
+
+    q_ids = question_index.search(term)
+    page_ids = q_ids[start:start + limit]
+    if not page_ids:
+        return [], len(q_ids)
+
+    rows = {row.id: row for row in Question.select_many(page_ids).with_entities(*Question.format_columns())}
+    return [rows[q_id] for q_id in page_ids if q_id in rows], len(q_ids)
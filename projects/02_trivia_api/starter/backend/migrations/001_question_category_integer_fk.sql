@@ -0,0 +1,42 @@
+-- Question.category used to be a text column holding Category.id values, so
+-- category filters compared strings and could not use an index. This turns
+-- it into an integer foreign key and adds the (category, id) and
+-- (category, difficulty) indexes the listings and quizzes scan.
+--
+-- Safe to run on a database restored from trivia.psql (already integer) and
+-- on one created by an older create_all (text):
+--     psql trivia < migrations/001_question_category_integer_fk.sql
+
+BEGIN;
+
+ALTER TABLE questions ALTER COLUMN category TYPE integer
+    USING CASE WHEN category::text ~ '^[0-9]+$' THEN category::text::integer END;
+
+-- a reference to a category that does not exist cannot be kept
+UPDATE questions SET category = NULL
+    WHERE category IS NOT NULL AND category NOT IN (SELECT id FROM categories);
+
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS category;
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_category_fkey;
+ALTER TABLE questions ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+    REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id);
+CREATE INDEX IF NOT EXISTS ix_questions_category_difficulty ON questions (category, difficulty);
+
+-- recount from the converted column (question_counts exists after `flask init-db`)
+DO $$
+BEGIN
+    IF to_regclass('question_counts') IS NOT NULL THEN
+        DELETE FROM question_counts;
+        INSERT INTO question_counts (category, difficulty, count)
+            SELECT category, difficulty, count(id) FROM questions
+            WHERE category IS NOT NULL AND difficulty IS NOT NULL
+            GROUP BY category, difficulty;
+    END IF;
+END
+$$;
+
+COMMIT;
+
+ANALYZE questions;
@@ -1,7 +1,10 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, DDL, event, inspect, select, func, create_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.dialects import postgresql
 from flask_sqlalchemy import SQLAlchemy
 import json
+from collections import Counter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,16 +17,112 @@ database_path = "postgresql://" + user_name + ":" + password + "@{}/{}".format('
 
 db = SQLAlchemy()
 
+'''
+on_questions_changed(listener)
+    registers listener(categories), called after every committed question
+    write with the set of categories whose questions changed
+'''
+question_change_listeners = []
+
+def on_questions_changed(listener):
+    question_change_listeners.append(listener)
+    return listener
+
+def questions_changed(categories):
+    categories = set(categories)
+    for listener in question_change_listeners:
+        listener(categories)
+
+'''
+increment(model, key, column, delta)
+    adds delta to `column` of the `model` row with primary key `key` (a dict),
+    creating the row when there is none, inside the current transaction; on
+    PostgreSQL a single INSERT ... ON CONFLICT DO UPDATE, so concurrent first
+    writes to the same key do not collide
+'''
+def increment(model, key, column, delta):
+    table = model.__table__
+    if db.engine.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(**dict(key, **{column: delta}))
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={column: table.c[column] + statement.excluded[column]})
+        db.session.execute(statement)
+        return
+
+    updated = model.query.filter_by(**key).update({table.c[column]: table.c[column] + delta}, synchronize_session=False)
+    if not updated:
+        db.session.add(model(**dict(key, **{column: delta})))
+
+def is_integer(value):
+    '''JSON integers only: bool is a subclass of int but not a number here'''
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+'''
+engine_options(database_path)
+    connection pool settings for PostgreSQL, from the environment:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE (seconds),
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS and DB_PGBOUNCER
+'''
+def engine_options(database_path):
+    if not database_path.startswith('postgresql'):
+        return {}
+
+    options = {
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    }
+
+    if env_flag('DB_PGBOUNCER', False):
+        # PgBouncer does the pooling; it also rejects the startup `options`
+        # parameter, so set statement_timeout on the PgBouncer side instead
+        options['poolclass'] = NullPool
+        return options
+
+    options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+    statement_timeout = os.environ.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout:
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(int(statement_timeout))}
+
+    return options
+
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service; tables are only
+    created when create_tables (default: the DB_CREATE_ALL environment
+    variable) is set, use `flask init-db` otherwise
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, create_tables=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    options = engine_options(database_path)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
+    if create_tables is None:
+        create_tables = env_flag('DB_CREATE_ALL', False)
+    if create_tables:
+        init_db()
+
+'''
+init_db()
+    creates missing tables and fills the question counts of a database that
+    was restored from a dump
+'''
+def init_db():
     db.create_all()
+    if QuestionCount.query.first() is None:
+        QuestionCount.rebuild()
 
 '''
 Question
@@ -31,11 +130,17 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  # category listings and keyset pagination walk (category, id) ranges, the
+  # quiz difficulty index loads (category, difficulty); see migrations/
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -45,15 +150,117 @@ class Question(db.Model):
     self.difficulty = difficulty
 
   def insert(self):
+    categories = {self.category}
     db.session.add(self)
+    QuestionCount.adjust({(self.category, self.difficulty): 1})
+    ContentVersion.bump(self.__tablename__)
     db.session.commit()
+    questions_changed(categories)
   
   def update(self):
+    state = inspect(self).attrs
+    old_category = (state.category.history.deleted or [self.category])[0]
+    old_difficulty = (state.difficulty.history.deleted or [self.difficulty])[0]
+    categories = {self.category, old_category}
+    deltas = Counter()
+    deltas[(old_category, old_difficulty)] -= 1
+    deltas[(self.category, self.difficulty)] += 1
+    QuestionCount.adjust(deltas)
+    ContentVersion.bump(self.__tablename__)
     db.session.commit()
+    questions_changed(categories)
 
   def delete(self):
+    categories = {self.category}
     db.session.delete(self)
+    QuestionCount.adjust({(self.category, self.difficulty): -1})
+    ContentVersion.bump(self.__tablename__)
+    db.session.commit()
+    questions_changed(categories)
+
+  @classmethod
+  def select_many(cls, ids=None, category=None, difficulty=None):
+    selection = cls.query
+    if ids is not None:
+      selection = selection.filter(cls.id.in_(ids))
+    if category is not None:
+      selection = selection.filter(cls.category == category)
+    if difficulty is not None:
+      selection = selection.filter(cls.difficulty == difficulty)
+    return selection
+
+  # the batch writes below target the ids they locked, not their filter again,
+  # so a question committed in between is neither changed nor left uncounted
+  ID_CHUNK_SIZE = 1000
+
+  @classmethod
+  def chunks_of_ids(cls, rows):
+    ids = [row.id for row in rows]
+    for start in range(0, len(ids), cls.ID_CHUNK_SIZE):
+      yield cls.query.filter(cls.id.in_(ids[start:start + cls.ID_CHUNK_SIZE]))
+
+  @classmethod
+  def delete_many(cls, ids=None, category=None, difficulty=None):
+    '''
+    deletes every question with one of `ids` and/or of the given category and
+    difficulty, in one transaction: the matching rows are locked, then deleted
+    by id (one DELETE per ID_CHUNK_SIZE ids); returns the deleted ids
+    '''
+    selection = cls.select_many(ids, category, difficulty)
+    rows = selection.with_entities(cls.id, cls.category, cls.difficulty).with_for_update().all()
+    if not rows:
+      db.session.rollback()
+      return []
+
+    for locked in cls.chunks_of_ids(rows):
+      locked.delete(synchronize_session=False)
+    QuestionCount.adjust({key: -n for key, n in Counter((row.category, row.difficulty) for row in rows).items()})
+    ContentVersion.bump(cls.__tablename__)
     db.session.commit()
+    questions_changed(row.category for row in rows)
+    return [row.id for row in rows]
+
+  @classmethod
+  def update_many(cls, changes, ids=None, category=None, difficulty=None):
+    '''
+    applies `changes` ({column: value}) to every question with one of `ids`
+    and/or of the given category and difficulty, in one transaction: the
+    matching rows are locked, then updated by id (one UPDATE per ID_CHUNK_SIZE
+    ids); returns the updated ids
+    '''
+    selection = cls.select_many(ids, category, difficulty)
+    rows = selection.with_entities(cls.id, cls.category, cls.difficulty).with_for_update().all()
+    if not rows:
+      db.session.rollback()
+      return []
+
+    for locked in cls.chunks_of_ids(rows):
+      locked.update({getattr(cls, column): value for column, value in changes.items()},
+                    synchronize_session=False)
+    deltas = Counter()
+    for row in rows:
+      deltas[(row.category, row.difficulty)] -= 1
+      deltas[(changes.get('category', row.category), changes.get('difficulty', row.difficulty))] += 1
+    QuestionCount.adjust(deltas)
+    ContentVersion.bump(cls.__tablename__)
+    db.session.commit()
+    categories = {row.category for row in rows}
+    if 'category' in changes:
+      categories.add(changes['category'])
+    questions_changed(categories)
+    return [row.id for row in rows]
+
+  # the keys of format(); list endpoints select these columns as plain rows
+  # and turn them into the same dicts with format_row, skipping the ORM
+  FORMAT_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+  @classmethod
+  def format_columns(cls):
+    return [getattr(cls, column) for column in cls.FORMAT_COLUMNS]
+
+  @classmethod
+  def format_row(cls, row):
+    return dict(zip(cls.FORMAT_COLUMNS, row))
 
   def format(self):
     return {
@@ -64,6 +271,15 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+# full-text search over question and answer text (see flaskr/search.py);
+# the expression has to match question_document() for the index to be used
+event.listen(
+  Question.__table__,
+  'after_create',
+  DDL("CREATE INDEX IF NOT EXISTS ix_questions_fts ON questions USING gin "
+      "(to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, '')))").execute_if(dialect='postgresql')
+)
+
 '''
 Category
 
@@ -81,4 +297,74 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+ContentVersion
+    a version number per table, bumped in the same transaction as every
+    write to that table; used to build ETags without reading the table
+'''
+class ContentVersion(db.Model):
+  __tablename__ = 'content_versions'
+
+  name = Column(String, primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+
+  @classmethod
+  def bump(cls, name):
+    increment(cls, {'name': name}, 'version', 1)
+
+  @classmethod
+  def get(cls, name):
+    return db.session.query(cls.version).filter(cls.name == name).scalar() or 0
+
+'''
+QuestionCount
+    number of questions per category and difficulty, kept up to date by the
+    Question write methods so counts never need a scan of questions
+'''
+class QuestionCount(db.Model):
+  __tablename__ = 'question_counts'
+
+  category = Column(Integer, primary_key=True)
+  difficulty = Column(Integer, primary_key=True)
+  count = Column(Integer, nullable=False, default=0)
+
+  @classmethod
+  def adjust(cls, deltas):
+    '''
+    adds {(category, difficulty): delta} to the counts inside the current
+    transaction
+    '''
+    for (category, difficulty), delta in deltas.items():
+      # questions without a category (or difficulty) are not counted, as in rebuild()
+      if not delta or category is None or difficulty is None:
+        continue
+      increment(cls, {'category': int(category), 'difficulty': int(difficulty)}, 'count', delta)
+
+  @classmethod
+  def rebuild(cls):
+    db.session.query(cls).delete(synchronize_session=False)
+    db.session.execute(cls.__table__.insert().from_select(
+      ['category', 'difficulty', 'count'],
+      select([Question.category, Question.difficulty, func.count(Question.id)])
+        .where(Question.category.isnot(None) & Question.difficulty.isnot(None))
+        .group_by(Question.category, Question.difficulty)
+    ))
+    db.session.commit()
+
+  @classmethod
+  def totals(cls):
+    '''
+    {category: {'total': n, 'by_difficulty': {difficulty: n}}}
+    '''
+    totals = {}
+    for row in cls.query.filter(cls.count > 0).order_by(cls.category, cls.difficulty):
+      category = totals.setdefault(row.category, {'total': 0, 'by_difficulty': {}})
+      category['total'] += row.count
+      category['by_difficulty'][row.difficulty] = row.count
+    return totals
+
+  @classmethod
+  def total(cls, category):
+    return db.session.query(func.coalesce(func.sum(cls.count), 0)).filter(cls.category == int(category)).scalar()
@@ -1,10 +1,77 @@
 import os
+import sys
+import random
 import unittest
 import json
+import gzip
+import asyncio
+from unittest import mock
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.quiz import pick_random_question, difficulty_index
+from models import setup_db, db, Question, Category, QuestionCount, ContentVersion
+
+
+class AsgiTestClient:
+    """Minimal stand-in for the Flask test client that sends requests through
+    the ASGI entry point (see asgi.py)."""
+
+    def __init__(self, app):
+        from asgiref.wsgi import WsgiToAsgi
+        self.asgi_app = WsgiToAsgi(app)
+
+    def open(self, path, method='GET', **kwargs):
+        environ = EnvironBuilder(path, method=method, **kwargs).get_environ()
+        body = environ['wsgi.input'].read()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': environ['PATH_INFO'],
+            'raw_path': environ['PATH_INFO'].encode(),
+            'query_string': environ['QUERY_STRING'].encode(),
+            'root_path': '',
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(key[5:].replace('_', '-').lower().encode(), value.encode())
+                        for key, value in environ.items()
+                        if key.startswith('HTTP_') and key[5:] not in ('CONTENT_TYPE', 'CONTENT_LENGTH')] +
+                       [(key.replace('_', '-').lower().encode(), environ[key].encode())
+                        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH') if environ.get(key)]
+        }
+        return asyncio.run(self._call(scope, body))
+
+    async def _call(self, scope, body):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.asgi_app(scope, receive, send)
+        start = next(m for m in messages if m['type'] == 'http.response.start')
+        return Response(b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body'),
+                        status=start['status'],
+                        headers=[(key.decode(), value.decode()) for key, value in start['headers']])
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, 'PATCH', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -13,10 +80,14 @@ class TriviaTestCase(unittest.TestCase):
     def setUp(self):
         """Define test variables and initialize app."""
         self.app = create_app()
-        self.client = self.app.test_client
+        # TRIVIA_TEST_SERVING_MODE=asgi runs the suite through the ASGI entry point
+        if os.environ.get('TRIVIA_TEST_SERVING_MODE') == 'asgi':
+            self.client = lambda: AsgiTestClient(self.app)
+        else:
+            self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgresql://postgres:dimulstR@{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        setup_db(self.app, self.database_path, create_tables=True)
 
         # binds the app to the current context
         with self.app.app_context():
@@ -41,6 +112,43 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
         self.assertTrue(len(data['categories']))
 
+    def test_new_category_invalidates_cached_categories(self):
+        self.client().get('/categories')
+        with self.app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            cat_id = category.id
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            db.session.delete(Category.query.get(cat_id))
+            db.session.commit()
+
+        self.assertEqual(data['categories'][str(cat_id)], 'Music')
+
+    def test_get_categories_with_question_counts(self):
+        res = self.client().get('/categories?counts=true')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question_counts']['2']['total'], 4)
+        self.assertEqual(sum(data['question_counts']['2']['by_difficulty'].values()), 4)
+
+    def test_question_counts_follow_writes(self):
+        self.client().post('/questions', json={'question': 'Counted?', 'answer': 'Yes',
+                                               'difficulty': 5, 'category': 2})
+        after_insert = json.loads(self.client().get('/categories?counts=true').data)
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Counted?').first().delete()
+        after_delete = json.loads(self.client().get('/categories?counts=true').data)
+
+        self.assertEqual(after_insert['question_counts']['2']['total'], 5)
+        self.assertEqual(after_insert['question_counts']['2']['by_difficulty']['5'], 1)
+        self.assertEqual(after_delete['question_counts']['2']['total'], 4)
+
     def test_405_for_POST_categories(self):
         res = self.client().post('/categories')
         data = json.loads(res.data)
@@ -61,6 +169,85 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(len(data['categories']))
 
+    def test_listed_questions_match_model_format(self):
+        data = json.loads(self.client().get('/questions?page=2').data)
+
+        with self.app.app_context():
+            expected = [Question.query.get(q['id']).format() for q in data['questions']]
+
+        self.assertEqual(data['questions'], expected)
+
+    def test_get_second_page_keeps_total(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], first['total_questions'])
+        self.assertTrue(len(data['questions']) <= 10)
+        self.assertNotEqual(data['questions'][0]['id'], first['questions'][0]['id'])
+
+    def test_walk_questions_by_cursor(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?after_id={}'.format(first['next_cursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], None)
+        self.assertTrue(data['questions'][0]['id'] > first['questions'][-1]['id'])
+
+    def test_422_for_malformed_cursor(self):
+        res = self.client().get('/questions?after_id=not-a-cursor')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_304_for_unchanged_questions_page(self):
+        etag = self.client().get('/questions').headers['ETag']
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_new_question_changes_questions_etag(self):
+        etag = self.client().get('/questions').headers['ETag']
+        self.client().post('/questions', json={'question': 'Etag?', 'answer': 'Yes',
+                                               'difficulty': 1, 'category': 1})
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Etag?').first().delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_question_write_invalidates_cached_category_listing(self):
+        before = json.loads(self.client().get('/categories/1/questions').data)
+        self.client().post('/questions', json={'question': 'Cached?', 'answer': 'No',
+                                               'difficulty': 1, 'category': 1})
+        after = json.loads(self.client().get('/categories/1/questions').data)
+
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Cached?').first().delete()
+
+        self.assertEqual(after['total_questions'], before['total_questions'] + 1)
+
+    def test_cached_listing_follows_writes_it_was_not_told_about(self):
+        self.client().get('/categories/4/questions')
+        # another worker's write: bumps the content version, but this
+        # process's cache is never invalidated
+        with self.app.app_context():
+            Question.query.filter(Question.id == 5).update({'answer': 'Maya Angelou (uncached)'}, synchronize_session=False)
+            ContentVersion.bump(Question.__tablename__)
+            db.session.commit()
+        after = json.loads(self.client().get('/categories/4/questions').data)
+
+        with self.app.app_context():
+            Question.query.filter(Question.id == 5).update({'answer': 'Maya Angelou'}, synchronize_session=False)
+            ContentVersion.bump(Question.__tablename__)
+            db.session.commit()
+
+        self.assertIn('Maya Angelou (uncached)', [q['answer'] for q in after['questions']])
+
     def test_404_sent_requesting_invalid_page(self):
         res = self.client().get('/questions?page=-200')
         data = json.loads(res.data)
@@ -84,6 +271,109 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.assertEqual(res.status_code, 422)
 
+    def test_bulk_import_questions(self):
+        body = '\n'.join([
+            json.dumps({'question': 'Bulk question?', 'answer': 'Bulk', 'category': 1, 'difficulty': 2}),
+            json.dumps({'question': 'No answer?', 'category': 1, 'difficulty': 2}),
+            'not json'
+        ])
+        res = self.client().post('/questions/import', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'Bulk question?').first().delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_bulk_import_rejects_non_integer_and_undecodable_rows(self):
+        body = b'\n'.join([
+            json.dumps({'question': 'Bool category?', 'answer': 'No', 'category': True, 'difficulty': 2}).encode(),
+            json.dumps({'question': 'Float difficulty?', 'answer': 'No', 'category': 1, 'difficulty': 2.7}).encode(),
+            b'\xff\xfe not utf-8'
+        ])
+        res = self.client().post('/questions/import', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 0)
+        self.assertEqual([error['line'] for error in data['errors']], [1, 2, 3])
+        self.assertEqual(data['errors'][2]['error'], 'not valid UTF-8')
+
+    def test_bulk_import_csv(self):
+        body = 'question,answer,category,difficulty\r\nCSV question?,CSV,2,3\r\nCSV float?,CSV,2,3.5\r\n'
+        res = self.client().post('/questions/import', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            Question.query.filter(Question.question == 'CSV question?').first().delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [3])
+
+    def test_422_bulk_import_unknown_format(self):
+        res = self.client().post('/questions/import', data='a,b', content_type='text/plain')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_export_questions_of_category(self):
+        res = self.client().get('/questions/export?category=6')
+        rows = [json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(res.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual([row['id'] for row in rows], [10, 11])
+
+    def test_export_questions_gzip(self):
+        res = self.client().get('/questions/export', headers={'Accept-Encoding': 'gzip'})
+        rows = gzip.decompress(res.data).decode('utf-8').splitlines()
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['Vary'], 'Accept-Encoding')
+        self.assertTrue(len(rows))
+
+    def test_instrumented_app_reports_queries(self):
+        app = create_app({'INSTRUMENTATION': True, 'PROFILE_SAMPLE_RATE': 0})
+        setup_db(app, self.database_path, create_tables=True)
+        client = app.test_client()
+
+        res = client.get('/questions')
+        metrics = json.loads(client.get('/metrics').data)
+
+        self.assertIn('queries"', res.headers['Server-Timing'])
+        self.assertEqual(metrics['endpoints']['retrieve_questions']['requests'], 1)
+        self.assertTrue(metrics['endpoints']['retrieve_questions']['queries_per_request'] >= 2)
+
+    def test_cached_listing_reads_content_version_once(self):
+        app = create_app({'INSTRUMENTATION': True, 'PROFILE_SAMPLE_RATE': 0})
+        setup_db(app, self.database_path, create_tables=True)
+        client = app.test_client()
+
+        client.get('/questions')
+        res = client.get('/questions')
+
+        self.assertIn('"1 queries"', res.headers['Server-Timing'])
+
+    def test_instrumented_app_stops_profiler_after_failed_request(self):
+        app = create_app({'INSTRUMENTATION': True, 'PROFILE_SAMPLE_RATE': 1})
+        setup_db(app, self.database_path, create_tables=True)
+
+        @app.route('/fail')
+        def fail():
+            raise RuntimeError('unhandled')
+
+        client = app.test_client()
+        res = client.get('/fail')
+        profiler_left = sys.getprofile()
+        metrics = json.loads(client.get('/metrics').data)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertIsNone(profiler_left)
+        self.assertEqual(metrics['endpoints']['fail']['requests'], 1)
+
     '''def test_delete_question(self):
         res = self.client().delete('/questions/33')
         data = json.loads(res.data)
@@ -94,6 +384,67 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(question, None)'''
 
+    def test_batch_delete_questions(self):
+        with self.app.app_context():
+            added = [Question(question='Batch?', answer='Batch', category=1, difficulty=1) for _ in range(2)]
+            for q in added:
+                q.insert()
+            added_ids = [q.id for q in added]
+
+        res = self.client().delete('/questions', json={'ids': added_ids + [-1]})
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            remaining = Question.query.filter(Question.id.in_(added_ids)).count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 2)
+        self.assertEqual(data['results'][-1], {'id': -1, 'status': 'not_found'})
+        self.assertEqual(remaining, 0)
+
+    def test_delete_question_without_category(self):
+        with self.app.app_context():
+            added = Question(question='Orphan?', answer='Orphan', category=None, difficulty=1)
+            added.insert()
+            q_id = added.id
+
+        res = self.client().delete('/questions/{}'.format(q_id))
+
+        with self.app.app_context():
+            question = Question.query.get(q_id)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(question, None)
+
+    def test_batch_update_questions(self):
+        with self.app.app_context():
+            added = Question(question='Batch update?', answer='Batch', category=1, difficulty=1)
+            added.insert()
+            q_id = added.id
+
+        res = self.client().patch('/questions', json={'ids': [q_id], 'changes': {'difficulty': 5}})
+        data = json.loads(res.data)
+
+        with self.app.app_context():
+            difficulty = Question.query.get(q_id).difficulty
+            Question.query.get(q_id).delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'], [{'id': q_id, 'status': 'updated'}])
+        self.assertEqual(difficulty, 5)
+
+    def test_422_batch_delete_without_criteria(self):
+        res = self.client().delete('/questions', json={})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_422_batch_requests_with_malformed_criteria(self):
+        for body in ([1, 2], {'filter': 'category'}, {'ids': [True]}, {'filter': {'category': '1'}}):
+            res = self.client().delete('/questions', json=body)
+            self.assertEqual(res.status_code, 422)
+        res = self.client().patch('/questions', json={'ids': [1], 'changes': {'difficulty': True}})
+        self.assertEqual(res.status_code, 422)
+
     def test_404_deleting_invalid_question_id(self):
         res = self.client().delete('/questions/-33')
         data = json.loads(res.data)
@@ -101,12 +452,46 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
 
     def test_search_question(self):
-        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        res = self.client().post('/questions', json={'searchTerm': 'soccer world'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(data['questions']), 2)
 
+    def test_search_reports_all_matches(self):
+        with self.app.app_context():
+            added = [Question(question='Zyzzyva question {}?'.format(i), answer='Zyzzyva',
+                              category=1, difficulty=1) for i in range(11)]
+            db.session.add_all(added)
+            db.session.commit()
+            added_ids = [q.id for q in added]
+
+        res = self.client().post('/questions', json={'searchTerm': 'zyzzyva'})
+        data = json.loads(res.data)
+        second_page = json.loads(self.client().post('/questions?page=2', json={'searchTerm': 'zyzzyva'}).data)
+
+        with self.app.app_context():
+            Question.query.filter(Question.id.in_(added_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertEqual(data['total_questions'], 11)
+        self.assertEqual(data['total_is_estimate'], False)
+        self.assertEqual(sorted(q['id'] for q in data['questions'] + second_page['questions']), added_ids)
+
+    def test_422_for_search_cursor(self):
+        res = self.client().post('/questions?after_id=MQ', json={'searchTerm': 'soccer'})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_search_matches_answer_prefix(self):
+        res = self.client().post('/questions', json={'searchTerm': 'scissor'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([q['id'] for q in data['questions']], [6])
+
     def test_422_when_searching_empty_string(self):
         res = self.client().post('/questions', json={'searchTerm': ''})
         data = json.loads(res.data)
@@ -119,6 +504,7 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(data['questions']), 4)
+        self.assertEqual(data['total_questions'], 4)
 
     def test_404_when_listing_questions_for_invalid_cat(self):
         res = self.client().get('/categories/2000/questions')
@@ -134,6 +520,107 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
 
+    def test_quiz_skips_previous_questions(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [10],
+                                                   'quiz_category': {'type': "Sports", 'id': "6"}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 11)
+
+    def test_quiz_picks_questions_uniformly_despite_id_gaps(self):
+        with self.app.app_context():
+            # the new id lies far above the category's 10 and 11
+            for _ in range(30):
+                Question(question='Gap filler?', answer='Gap', category=1, difficulty=1).insert()
+            added = Question(question='After a gap?', answer='Gap', category=6, difficulty=1)
+            added.insert()
+            q_id = added.id
+            for filler in Question.query.filter(Question.question == 'Gap filler?').all():
+                filler.delete()
+
+            random.seed(0)
+            picks = [pick_random_question(6, []).id for _ in range(200)]
+            Question.query.get(q_id).delete()
+
+        self.assertEqual(set(picks), {10, 11, q_id})
+        self.assertTrue(40 <= picks.count(q_id) <= 95)
+
+    def test_adaptive_quiz_raises_difficulty_after_right_answers(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': {'type': "Sports", 'id': "6"},
+                                                   'mode': 'adaptive',
+                                                   'difficulty': 3,
+                                                   'recent_answers': [True, True, False]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['difficulty'], 4)
+        self.assertEqual(data['question']['id'], 11)
+
+    def test_adaptive_quiz_falls_back_to_closest_band(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [11],
+                                                   'quiz_category': {'type': "Sports", 'id': "6"},
+                                                   'mode': 'adaptive',
+                                                   'difficulty': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 10)
+
+    def test_difficulty_index_keeps_invalidation_that_raced_its_load(self):
+        real_query = db.session.query
+        added = []
+
+        def read_then_write(*entities):
+            rows = real_query(*entities).all()
+            if not added:
+                # a write lands after the index read its rows
+                question = Question(question='Raced?', answer='Raced', category=1, difficulty=1)
+                question.insert()
+                added.append(question.id)
+            return rows
+
+        with self.app.app_context():
+            difficulty_index.clear()
+            with mock.patch.object(db.session, 'query', read_then_write):
+                difficulty_index.ids(None)
+            ids = difficulty_index.ids(None)
+            Question.query.get(added[0]).delete()
+
+        self.assertIn(added[0], ids)
+
+    def test_adaptive_quiz_skips_question_deleted_elsewhere(self):
+        with self.app.app_context():
+            added = Question(question='Stale?', answer='Stale', category=6, difficulty=5)
+            added.insert()
+            q_id = added.id
+        # warm the difficulty index, then delete the question the way another
+        # worker would: this process is never told about the write
+        self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': "Sports", 'id': "6"},
+                                             'mode': 'adaptive', 'difficulty': 5})
+        with self.app.app_context():
+            Question.query.filter(Question.id == q_id).delete()
+            QuestionCount.adjust({(6, 5): -1})
+            db.session.commit()
+
+        res = self.client().post('/quizzes', json={'previous_questions': [11],
+                                                   'quiz_category': {'type': "Sports", 'id': "6"},
+                                                   'mode': 'adaptive',
+                                                   'difficulty': 5})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 10)
+
+    def test_422_adaptive_quiz_with_boolean_difficulty(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [],
+                                                   'quiz_category': {'type': "Sports", 'id': "6"},
+                                                   'mode': 'adaptive',
+                                                   'difficulty': True})
+
+        self.assertEqual(res.status_code, 422)
+
     def test_null_wrong_category_for_quiz(self):
         res = self.client().post('/quizzes', json={'previous_questions': [],
                                                    'quiz_category': {'type': "Sports", 'id': "6000"}})
@@ -142,6 +629,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['question'], None)
 
+    def test_quiz_session_deals_each_question_once(self):
+        res = self.client().post('/quizzes/sessions', json={'quiz_category': {'type': "Sports", 'id': "6"}})
+        data = json.loads(res.data)
+        session_id = data['session_id']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+
+        dealt = []
+        for _ in range(2):
+            res = self.client().post('/quizzes/sessions/{}/next'.format(session_id))
+            dealt.append(json.loads(res.data)['question']['id'])
+        last = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id)).data)
+
+        self.assertEqual(sorted(dealt), [10, 11])
+        self.assertEqual(last['question'], None)
+
+    def test_404_next_question_for_unknown_quiz_session(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_422_no_category_for_quiz(self):
         res = self.client().post('/quizzes', json={'previous_questions': []})
 